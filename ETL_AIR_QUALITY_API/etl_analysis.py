@@ -3,7 +3,7 @@
 Analysis script: read air_quality_data from Supabase and produce:
  - summary_metrics.csv
  - city_risk_distribution.csv
- - pollution_trends.csv
+ - pollution_trends.csv (+ pollution_trends.parquet when pyarrow is installed)
  - PNG visualizations:
     - pm25_histogram.png
     - risk_flags_by_city.png
@@ -11,14 +11,32 @@ Analysis script: read air_quality_data from Supabase and produce:
     - severity_vs_pm25_scatter.png
 Requirements:
  - SUPABASE_URL and SUPABASE_KEY in env/.env
- - pandas, matplotlib, python-dotenv, supabase
+ - pandas, numpy, matplotlib, python-dotenv, supabase
+ - Optional: functions kpi_summary(), city_risk_dist(), city_risk_counts(), hourly_pollution_by_city()
+   and pm25_severity_sample() created from print_aggregate_sql(); with them the table itself is not
+   downloaded, without them everything is computed client-side.
+Flags (env, "1" = on):
+ - ETL_USE_RPC (default 0): build every output from the RPC functions instead of downloading the table
+ - ETL_PARQUET_CACHE (default 1): reuse data/cache/air_quality.parquet while the table is unchanged
+Performance notes:
+ - Fetching the table is network-bound (paged HTTPS round-trips + JSON decode); the flags above
+   cut bytes on the wire. The pandas side is memory-bound column scans (categories, one groupby
+   per axis) and plot rendering. There are no per-row Python loops left.
+ - Profile before tuning further: python -m cProfile -s cumtime etl_analysis.py
 """
 from __future__ import annotations
 
 import os
 from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+import numpy as np
 import pandas as pd
+import matplotlib
+
+matplotlib.use("Agg")  # headless: render straight to PNG, never open a GUI window
 import matplotlib.pyplot as plt
+from matplotlib.axes import Axes
+from matplotlib.figure import Figure
 from dotenv import load_dotenv
 
 try:
@@ -26,6 +44,12 @@ try:
 except Exception as e:
     raise ImportError("Please install supabase: pip install supabase") from e
 
+# Optional: Parquet copy of the trends output
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
 load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
@@ -37,33 +61,307 @@ sb = create_client(SUPABASE_URL, SUPABASE_KEY)
 OUTPUT_DIR = Path("data") / "processed"
 OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 PLOTS_DIR = OUTPUT_DIR  # same folder for CSVs and PNGs
+CACHE_FILE = Path("data") / "cache" / "air_quality.parquet"  # local copy of the table, see fetch_table_as_df()
+
+USE_RPC = os.getenv("ETL_USE_RPC", "0") == "1"
+PARQUET_CACHE = os.getenv("ETL_PARQUET_CACHE", "1") == "1"
 
 TABLE_NAME = "air_quality_data"
+SCATTER_MAX_POINTS = 50_000  # larger tables are randomly sampled for the scatter plot
+# only the columns the analysis uses (id drives the keyset pagination)
+FETCH_COLUMNS = "id,city,time,pm2_5,pm10,ozone,severity_score,risk_flag"
+FLOAT_COLS = ["pm2_5", "pm10", "ozone", "severity_score"]
+RISK_FLAGS = ["High Risk", "Moderate Risk", "Low Risk"]
+FETCH_PAGE_SIZE = int(os.getenv("FETCH_PAGE_SIZE", "1000"))  # rows per request (Supabase default max-rows is 1000)
+
+# Server-side aggregates (run once in the Supabase SQL editor, see print_aggregate_sql()).
+# Each function returns the same columns the client-side helpers below produce.
+AGGREGATE_SQL = """
+CREATE INDEX IF NOT EXISTS air_quality_data_city_time_idx ON air_quality_data (city, "time");
+CREATE INDEX IF NOT EXISTS air_quality_data_risk_flag_idx ON air_quality_data (risk_flag);
+
+CREATE OR REPLACE FUNCTION kpi_summary()
+RETURNS TABLE (
+    city_highest_avg_pm2_5 TEXT,
+    highest_avg_pm2_5_value DOUBLE PRECISION,
+    city_highest_avg_severity TEXT,
+    highest_avg_severity_value DOUBLE PRECISION,
+    pct_high_risk DOUBLE PRECISION,
+    pct_moderate_risk DOUBLE PRECISION,
+    pct_low_risk DOUBLE PRECISION,
+    hour_with_worst_avg_pm2_5 INTEGER,
+    worst_hour_avg_pm2_5 DOUBLE PRECISION
+)
+LANGUAGE sql STABLE AS $$
+    WITH pm AS (
+        SELECT city, AVG(pm2_5) AS v FROM air_quality_data
+        WHERE city IS NOT NULL AND pm2_5 IS NOT NULL
+        GROUP BY city ORDER BY v DESC LIMIT 1
+    ),
+    sev AS (
+        SELECT city, AVG(severity_score) AS v FROM air_quality_data
+        WHERE city IS NOT NULL AND severity_score IS NOT NULL
+        GROUP BY city ORDER BY v DESC LIMIT 1
+    ),
+    risk AS (
+        SELECT
+            COALESCE(100.0 * COUNT(*) FILTER (WHERE risk_flag = 'High Risk') / NULLIF(COUNT(risk_flag), 0), 0) AS high,
+            COALESCE(100.0 * COUNT(*) FILTER (WHERE risk_flag = 'Moderate Risk') / NULLIF(COUNT(risk_flag), 0), 0) AS moderate,
+            COALESCE(100.0 * COUNT(*) FILTER (WHERE risk_flag = 'Low Risk') / NULLIF(COUNT(risk_flag), 0), 0) AS low
+        FROM air_quality_data
+    ),
+    hr AS (
+        SELECT EXTRACT(HOUR FROM "time" AT TIME ZONE 'UTC')::INTEGER AS h, AVG(pm2_5) AS v
+        FROM air_quality_data WHERE "time" IS NOT NULL AND pm2_5 IS NOT NULL
+        GROUP BY 1 ORDER BY v DESC LIMIT 1
+    )
+    SELECT pm.city, pm.v, sev.city, sev.v, risk.high, risk.moderate, risk.low, hr.h, hr.v
+    FROM risk LEFT JOIN pm ON TRUE LEFT JOIN sev ON TRUE LEFT JOIN hr ON TRUE;
+$$;
+
+CREATE OR REPLACE FUNCTION city_risk_dist()
+RETURNS TABLE (
+    city TEXT,
+    high_risk_pct DOUBLE PRECISION,
+    moderate_risk_pct DOUBLE PRECISION,
+    low_risk_pct DOUBLE PRECISION
+)
+LANGUAGE sql STABLE AS $$
+    SELECT
+        city,
+        COALESCE(100.0 * COUNT(*) FILTER (WHERE risk_flag = 'High Risk') / NULLIF(COUNT(risk_flag), 0), 0),
+        COALESCE(100.0 * COUNT(*) FILTER (WHERE risk_flag = 'Moderate Risk') / NULLIF(COUNT(risk_flag), 0), 0),
+        COALESCE(100.0 * COUNT(*) FILTER (WHERE risk_flag = 'Low Risk') / NULLIF(COUNT(risk_flag), 0), 0)
+    FROM air_quality_data
+    WHERE city IS NOT NULL
+    GROUP BY city ORDER BY city;
+$$;
+
+CREATE OR REPLACE FUNCTION city_risk_counts()
+RETURNS TABLE (city TEXT, high_risk BIGINT, moderate_risk BIGINT, low_risk BIGINT)
+LANGUAGE sql STABLE AS $$
+    SELECT
+        city,
+        COUNT(*) FILTER (WHERE risk_flag = 'High Risk'),
+        COUNT(*) FILTER (WHERE risk_flag = 'Moderate Risk'),
+        COUNT(*) FILTER (WHERE risk_flag = 'Low Risk')
+    FROM air_quality_data
+    WHERE city IS NOT NULL
+    GROUP BY city ORDER BY city;
+$$;
+
+-- One page of hourly means per city, in (city, hour) order, starting after the hour
+-- (after_city, after_time). The page is cut from the (city, time) index before aggregating,
+-- so each call is a bounded range scan; a full page drops its last hour (it may be cut short)
+-- and the next call starts there. Assumes fewer than page_size rows per city-hour.
+CREATE OR REPLACE FUNCTION hourly_pollution_by_city(
+    after_city TEXT DEFAULT NULL,
+    after_time TIMESTAMPTZ DEFAULT NULL,
+    page_size INTEGER DEFAULT 1000
+)
+RETURNS TABLE (city TEXT, "time" TIMESTAMPTZ, pm2_5 DOUBLE PRECISION, pm10 DOUBLE PRECISION, ozone DOUBLE PRECISION)
+LANGUAGE sql STABLE AS $$
+    WITH page AS (
+        SELECT d.city, date_trunc('hour', d."time") AS hour, d.pm2_5, d.pm10, d.ozone
+        FROM air_quality_data d
+        WHERE d.city IS NOT NULL AND d."time" IS NOT NULL
+          AND (after_city IS NULL OR (d.city, d."time") >= (after_city, after_time + INTERVAL '1 hour'))
+        ORDER BY d.city, d."time"
+        LIMIT page_size
+    ),
+    tail AS (
+        SELECT p.city, p.hour FROM page p
+        WHERE (SELECT COUNT(*) FROM page) = page_size
+        ORDER BY p.city DESC, p.hour DESC LIMIT 1
+    )
+    SELECT p.city, p.hour, AVG(p.pm2_5), AVG(p.pm10), AVG(p.ozone)
+    FROM page p
+    WHERE NOT EXISTS (SELECT 1 FROM tail t WHERE t.city = p.city AND t.hour = p.hour)
+    GROUP BY p.city, p.hour
+    ORDER BY p.city, p.hour;
+$$;
+
+-- Every n-th row by id (n from MAX(id), an index lookup), at most max_points rows:
+-- one call that stays under PostgREST's max-rows.
+CREATE OR REPLACE FUNCTION pm25_severity_sample(max_points INTEGER DEFAULT 1000)
+RETURNS TABLE (pm2_5 DOUBLE PRECISION, severity_score DOUBLE PRECISION)
+LANGUAGE sql STABLE AS $$
+    SELECT d.pm2_5, d.severity_score
+    FROM air_quality_data d
+    WHERE d.id % (SELECT GREATEST(CEIL(MAX(a.id)::NUMERIC / max_points), 1)::BIGINT FROM air_quality_data a) = 0
+    ORDER BY d.id
+    LIMIT max_points;
+$$;
+"""
 
 
-def fetch_table_as_df() -> pd.DataFrame:
-    """
-    Fetch entire table from Supabase into a pandas DataFrame.
-    Note: For large datasets, implement pagination. For now, fetch all.
-    """
-    # supabase-py: sb.table(TABLE_NAME).select("*").execute()
-    res = sb.table(TABLE_NAME).select("*").execute()
+def _response_data(res):
+    """Extract the row list from a supabase-py response (object with .data, dict or list)."""
     if isinstance(res, dict) and res.get("error"):
         raise RuntimeError(f"Supabase error: {res['error']}")
     # result may be object with .data
-    data = None
     if hasattr(res, "data"):
-        data = res.data
-    elif isinstance(res, dict) and "data" in res:
-        data = res["data"]
-    else:
-        # fallback: try treating res as list
-        data = res
-    df = pd.DataFrame(data)
+        return res.data
+    if isinstance(res, dict) and "data" in res:
+        return res["data"]
+    # fallback: try treating res as list
+    return res
+
+
+def _iter_table_pages(columns: str = "*") -> Iterator[List[dict]]:
+    """
+    Yield the table page by page using keyset pagination on the primary key
+    (id > last_id ORDER BY id LIMIT n). Each page is an index range scan, and
+    PostgREST's max-rows cap can no longer silently truncate the result.
+    """
+    last_id = None
+    while True:
+        query = sb.table(TABLE_NAME).select(columns).order("id").limit(FETCH_PAGE_SIZE)
+        if last_id is not None:
+            query = query.gt("id", last_id)
+        rows = _response_data(query.execute())
+        # stop on an empty page rather than a short one: the server may cap pages below FETCH_PAGE_SIZE
+        if not rows:
+            break
+        yield rows
+        last_id = rows[-1]["id"]
+
+
+def _download_table() -> pd.DataFrame:
+    """
+    Download the entire table from Supabase into a pandas DataFrame (paginated, see _iter_table_pages).
+    """
+    rows: List[dict] = []
+    for page in _iter_table_pages(FETCH_COLUMNS):
+        rows.extend(page)
+    # build the frame once instead of concatenating per page
+    df = pd.DataFrame(rows)
     # normalize column names if needed
     return df
 
 
+def _table_fingerprint() -> Tuple[Optional[int], Optional[str]]:
+    """
+    Cheap freshness key for the local cache: (row count, latest time).
+    One row crosses the wire; the count comes back in the response header.
+    NULLs sort last, otherwise one NULL time would make latest None and the cache never hit.
+    """
+    res = (
+        sb.table(TABLE_NAME)
+        .select("time", count="exact")
+        .order("time", desc=True, nullsfirst=False)
+        .limit(1)
+        .execute()
+    )
+    rows = _response_data(res)
+    latest = rows[0]["time"] if rows else None
+    return getattr(res, "count", None), latest
+
+
+def fetch_table_as_df() -> pd.DataFrame:
+    """
+    Fetch entire table from Supabase into a pandas DataFrame.
+    With ETL_PARQUET_CACHE=1 the download is cached in CACHE_FILE (Parquet, zstd) and reused as long
+    as the table's row count and latest time are unchanged, so re-running the analysis skips the download.
+    """
+    if not PARQUET_CACHE:
+        return _download_table()
+
+    count, latest = _table_fingerprint()
+    if count and CACHE_FILE.exists():
+        try:
+            cached = pd.read_parquet(CACHE_FILE)
+            if len(cached) == count and cached["time"].max() == latest:
+                print(f"Using cached table from {CACHE_FILE} ({count} rows)")
+                return cached
+        except Exception as e:
+            print(f"Could not read cache {CACHE_FILE}: {e}")
+
+    df = _download_table()
+    try:
+        CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+        df.to_parquet(CACHE_FILE, compression="zstd", index=False)
+    except ImportError as e:
+        print(f"Parquet cache not written ({e})")
+    return df
+
+
+def print_aggregate_sql():
+    """
+    Prints the SQL for the server-side aggregate functions used by fetch_aggregates().
+    Run this SQL once in the Supabase SQL editor.
+    """
+    print("Run this SQL in Supabase (SQL Editor) to create the aggregate functions:\n")
+    print(AGGREGATE_SQL)
+
+
+def _fetch_hourly_trends() -> pd.DataFrame:
+    """
+    Page through hourly_pollution_by_city() by keyset on (city, hour): each call passes the
+    last row of the previous page as after_city/after_time, so no page re-scans earlier rows.
+    """
+    rows: List[dict] = []
+    params = {"page_size": FETCH_PAGE_SIZE}
+    while True:
+        page = _response_data(sb.rpc("hourly_pollution_by_city", params).execute())
+        if not page:
+            break
+        rows.extend(page)
+        params = {"after_city": page[-1]["city"], "after_time": page[-1]["time"], "page_size": FETCH_PAGE_SIZE}
+    return pd.DataFrame(rows, columns=["city", "time", "pm2_5", "pm10", "ozone"])
+
+
+def fetch_aggregates() -> Optional[Dict[str, pd.DataFrame]]:
+    """
+    Fetch everything save_csvs_and_plots() needs via PostgREST RPC, without downloading the table:
+    KPIs, risk distribution and per-city risk counts (a few rows each), hourly trends per city
+    (keyset-paged; one row per city-hour, so about the table's row count for hourly data, but only
+    five columns) and a pm2_5/severity sample of at most FETCH_PAGE_SIZE rows for the plots.
+    Returns None if the functions are not installed (see print_aggregate_sql()).
+    """
+    try:
+        kpis = pd.DataFrame(_response_data(sb.rpc("kpi_summary", {}).execute()))
+        risk_dist = pd.DataFrame(_response_data(sb.rpc("city_risk_dist", {}).execute()))
+        risk = pd.DataFrame(
+            _response_data(sb.rpc("city_risk_counts", {}).execute()),
+            columns=["city", "high_risk", "moderate_risk", "low_risk"],
+        )
+        trends = _fetch_hourly_trends()
+        points = pd.DataFrame(
+            _response_data(sb.rpc("pm25_severity_sample", {"max_points": FETCH_PAGE_SIZE}).execute()),
+            columns=["pm2_5", "severity_score"],
+        )
+    except Exception as e:
+        print(f"RPC aggregates unavailable ({e}); computing aggregates client-side.")
+        return None
+
+    # same wide shape as the client-side counts: index city, one column per risk flag
+    risk_counts = risk.set_index("city")
+    risk_counts.columns = pd.Index(["High Risk", "Moderate Risk", "Low Risk"], name="risk_flag")
+    trends["time"] = pd.to_datetime(trends["time"], errors="coerce", utc=True)
+    for col in ["pm2_5", "pm10", "ozone"]:
+        trends[col] = pd.to_numeric(trends[col], errors="coerce")
+    for col in ["pm2_5", "severity_score"]:
+        points[col] = pd.to_numeric(points[col], errors="coerce")
+    return {"kpis": kpis, "risk_dist": risk_dist, "risk_counts": risk_counts, "trends": trends, "points": points}
+
+
+def _coerce_types(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Convert columns to their working dtypes in a single pass, so the KPI/trend helpers
+    don't re-parse them: numerics, UTC time, derived hour, and categorical labels.
+    """
+    # float64 for the KPIs/trends written to CSV; float32 is only used for the plot arrays
+    for col in FLOAT_COLS:
+        df[col] = pd.to_numeric(df.get(col), errors="coerce").astype("float64")
+    df["time"] = pd.to_datetime(df.get("time"), errors="coerce", utc=True)
+    df["hour"] = df["time"].dt.hour
+    # low-cardinality labels as categories: groupby/value_counts then work on integer codes
+    df["city"] = df["city"].astype("category")
+    df["risk_flag"] = pd.Categorical(df["risk_flag"], categories=RISK_FLAGS)
+    return df
+
+
 def compute_kpis(df: pd.DataFrame) -> pd.DataFrame:
     """
     Compute requested KPI metrics:
@@ -72,16 +370,15 @@ def compute_kpis(df: pd.DataFrame) -> pd.DataFrame:
     - Percentage of High/Moderate/Low risk hours (overall)
     - Hour of day with worst AQI (use average pm2_5 per hour)
     Returns a single-row DataFrame with metrics.
+    Expects a frame already passed through _coerce_types().
     """
-    # ensure types
-    df["pm2_5"] = pd.to_numeric(df.get("pm2_5"), errors="coerce")
-    df["severity_score"] = pd.to_numeric(df.get("severity_score"), errors="coerce")
-    df["time"] = pd.to_datetime(df.get("time"), errors="coerce", utc=True)
-
     kpis = {}
 
+    # City-level means in one grouped pass
+    by_city = df.groupby("city", observed=True).agg(pm=("pm2_5", "mean"), sev=("severity_score", "mean"))
+
     # City with highest avg PM2.5
-    pm25_by_city = df.groupby("city")["pm2_5"].mean().dropna()
+    pm25_by_city = by_city["pm"].dropna()
     if not pm25_by_city.empty:
         city_high_pm25 = pm25_by_city.idxmax()
         kpis["city_highest_avg_pm2_5"] = city_high_pm25
@@ -91,7 +388,7 @@ def compute_kpis(df: pd.DataFrame) -> pd.DataFrame:
         kpis["highest_avg_pm2_5_value"] = None
 
     # City with highest severity score (avg)
-    sev_by_city = df.groupby("city")["severity_score"].mean().dropna()
+    sev_by_city = by_city["sev"].dropna()
     if not sev_by_city.empty:
         city_high_sev = sev_by_city.idxmax()
         kpis["city_highest_avg_severity"] = city_high_sev
@@ -104,13 +401,12 @@ def compute_kpis(df: pd.DataFrame) -> pd.DataFrame:
     # risk_flag values expected: "High Risk", "Moderate Risk", "Low Risk"
     risk_counts = df["risk_flag"].value_counts(dropna=True)
     total_risk = risk_counts.sum() if not risk_counts.empty else 0
-    for flag in ["High Risk", "Moderate Risk", "Low Risk"]:
+    for flag in RISK_FLAGS:
         pct = (risk_counts.get(flag, 0) / total_risk * 100) if total_risk > 0 else 0.0
         kpis[f"pct_{flag.replace(' ', '_').lower()}"] = pct
 
     # Hour of day with worst AQI (use mean pm2_5 by hour across all cities)
     if "time" in df.columns and not df["time"].isna().all():
-        df["hour"] = df["time"].dt.hour
         hr_pm25 = df.groupby("hour")["pm2_5"].mean().dropna()
         if not hr_pm25.empty:
             worst_hr = int(hr_pm25.idxmax())
@@ -126,28 +422,25 @@ def compute_kpis(df: pd.DataFrame) -> pd.DataFrame:
     return pd.DataFrame([kpis])
 
 
-def city_risk_distribution(df: pd.DataFrame) -> pd.DataFrame:
+def risk_flag_counts(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Count risk_flag values per city in one grouped pass.
+    Returns a wide frame: index city, one column per risk flag.
+    """
+    return df.groupby("city", observed=True)["risk_flag"].value_counts().unstack(fill_value=0)
+
+
+def city_risk_distribution(risk_counts: pd.DataFrame) -> pd.DataFrame:
     """
-    For each city, compute percentage distribution of risk_flag categories.
+    For each city, compute percentage distribution of risk_flag categories
+    from the per-city counts produced by risk_flag_counts() (a reshape, no groupby).
     Output columns: city, high_risk_pct, moderate_risk_pct, low_risk_pct
     """
-    # ensure consistent risk_flag
-    dist = []
-    for city, group in df.groupby("city"):
-        counts = group["risk_flag"].value_counts(dropna=True)
-        total = counts.sum() if not counts.empty else 0
-        high = counts.get("High Risk", 0)
-        moderate = counts.get("Moderate Risk", 0)
-        low = counts.get("Low Risk", 0)
-        dist.append(
-            {
-                "city": city,
-                "high_risk_pct": (high / total * 100) if total > 0 else 0.0,
-                "moderate_risk_pct": (moderate / total * 100) if total > 0 else 0.0,
-                "low_risk_pct": (low / total * 100) if total > 0 else 0.0,
-            }
-        )
-    return pd.DataFrame(dist)
+    totals = risk_counts.sum(axis=1)
+    pct = risk_counts.reindex(columns=RISK_FLAGS, fill_value=0).div(totals, axis=0).mul(100).fillna(0.0)
+    pct.columns = ["high_risk_pct", "moderate_risk_pct", "low_risk_pct"]
+    pct.index.name = "city"
+    return pct.reset_index()
 
 
 def pollution_trends(df: pd.DataFrame) -> pd.DataFrame:
@@ -156,7 +449,6 @@ def pollution_trends(df: pd.DataFrame) -> pd.DataFrame:
     Aggregated at hourly time already in table. Return long-form DataFrame with columns:
     city, time, pm2_5, pm10, ozone
     """
-    df["time"] = pd.to_datetime(df["time"], errors="coerce", utc=True)
     df = df.dropna(subset=["time"])
     out = df[["city", "time", "pm2_5", "pm10", "ozone"]].copy()
     # sort
@@ -164,77 +456,126 @@ def pollution_trends(df: pd.DataFrame) -> pd.DataFrame:
     return out
 
 
-def save_csvs_and_plots(df: pd.DataFrame):
-    # Ensure numeric conversions early
-    df["pm2_5"] = pd.to_numeric(df.get("pm2_5"), errors="coerce")
-    df["pm10"] = pd.to_numeric(df.get("pm10"), errors="coerce")
-    df["severity_score"] = pd.to_numeric(df.get("severity_score"), errors="coerce")
-    df["time"] = pd.to_datetime(df.get("time"), errors="coerce", utc=True)
+def _reset_figure(fig: Figure, figsize: Tuple[float, float]) -> Axes:
+    """Clear the shared figure, resize it, and return a fresh Axes."""
+    fig.clf()
+    fig.set_size_inches(*figsize)
+    return fig.add_subplot()
+
+
+def _save_figure(fig: Figure, path: Path) -> None:
+    fig.tight_layout()
+    fig.savefig(path, dpi=150)
+
+
+def save_csvs_and_plots(df: Optional[pd.DataFrame], aggregates: Optional[Dict[str, pd.DataFrame]] = None):
+    """
+    Write CSV outputs and PNG plots.
+    If `aggregates` (from fetch_aggregates()) is given, every output is built from the server-side
+    results and `df` is not used (pass None); otherwise everything is computed from `df`.
+    """
+    if aggregates is not None:
+        summary_df = aggregates["kpis"]
+        risk_dist_df = aggregates["risk_dist"]
+        risk_counts = aggregates["risk_counts"]
+        trends_df = aggregates["trends"]
+        points = aggregates["points"]  # pm2_5 / severity_score sample for the histogram and scatter
+    else:
+        # Ensure types once; the helpers below rely on them
+        df = _coerce_types(df)
+        summary_df = compute_kpis(df)
+        # per-city risk flag counts, shared by the distribution CSV and the bar chart
+        risk_counts = risk_flag_counts(df)
+        risk_dist_df = city_risk_distribution(risk_counts)
+        trends_df = pollution_trends(df)
+        points = df
 
     # CSV outputs
-    summary_df = compute_kpis(df)
     summary_df.to_csv(OUTPUT_DIR / "summary_metrics.csv", index=False)
-
-    risk_dist_df = city_risk_distribution(df)
     risk_dist_df.to_csv(OUTPUT_DIR / "city_risk_distribution.csv", index=False)
-
-    trends_df = pollution_trends(df)
     trends_df.to_csv(OUTPUT_DIR / "pollution_trends.csv", index=False)
+    if pa is not None:
+        # columnar, compressed copy for downstream consumers
+        trends_df.to_parquet(OUTPUT_DIR / "pollution_trends.parquet", index=False)
+
+    # one Figure reused for every plot: cleared and resized instead of reallocated
+    fig = plt.figure()
 
     # 1) Histogram of PM2.5
-    plt.figure(figsize=(8, 5))
-    df["pm2_5"].dropna().hist(bins=30)
-    plt.title("Histogram of PM2.5")
-    plt.xlabel("PM2.5 (µg/m³)")
-    plt.ylabel("Frequency")
-    plt.tight_layout()
-    plt.savefig(PLOTS_DIR / "pm25_histogram.png", dpi=150)
-    plt.close()
+    ax = _reset_figure(fig, (8, 5))
+    # bin with NumPy on a float32 array instead of going through Series.hist
+    pm25 = points["pm2_5"].to_numpy(dtype=np.float32, na_value=np.nan)
+    pm25 = pm25[~np.isnan(pm25)]
+    counts, edges = np.histogram(pm25, bins=30)
+    ax.bar(edges[:-1], counts, width=np.diff(edges), align="edge")
+    ax.grid(True)
+    ax.set_title("Histogram of PM2.5")
+    ax.set_xlabel("PM2.5 (µg/m³)")
+    ax.set_ylabel("Frequency")
+    _save_figure(fig, PLOTS_DIR / "pm25_histogram.png")
 
     # 2) Bar chart of risk flags per city
-    plt.figure(figsize=(10, 6))
-    risk_counts = df.groupby("city")["risk_flag"].value_counts().unstack(fill_value=0)
-    # use pandas plotting (returns axes)
-    ax = risk_counts.plot(kind="bar", stacked=False, figsize=(10, 6))
+    ax = _reset_figure(fig, (10, 6))
+    # use pandas plotting on our axes
+    risk_counts.plot(kind="bar", stacked=False, ax=ax)
     ax.set_title("Risk Flags per City")
     ax.set_ylabel("Count")
-    plt.tight_layout()
-    plt.savefig(PLOTS_DIR / "risk_flags_by_city.png", dpi=150)
-    plt.close()
+    _save_figure(fig, PLOTS_DIR / "risk_flags_by_city.png")
 
     # 3) Line chart of hourly PM2.5 trends (each city line)
-    plt.figure(figsize=(12, 6))
-    # group by city and compute hourly mean of pm2_5 (select column BEFORE resampling)
-    for city, group in trends_df.groupby("city"):
-        # make sure 'time' is datetime and set as index
-        grp = group.set_index("time")
-        # select numeric column explicitly, resample hourly with 'h' (lowercase)
-        pm25_hourly = grp["pm2_5"].resample("h").mean()
-        if pm25_hourly.dropna().empty:
-            continue
-        plt.plot(pm25_hourly.index, pm25_hourly.values, label=city)
-    plt.legend()
-    plt.title("Hourly PM2.5 Trends by City")
-    plt.xlabel("Time (UTC)")
-    plt.ylabel("PM2.5 (µg/m³)")
-    plt.tight_layout()
-    plt.savefig(PLOTS_DIR / "hourly_pm25_trends.png", dpi=150)
-    plt.close()
+    ax = _reset_figure(fig, (12, 6))
+    # wide frame: one column of hourly mean pm2_5 per city
+    if aggregates is not None:
+        # already hourly means per city from hourly_pollution_by_city()
+        hourly = trends_df.pivot(index="time", columns="city", values="pm2_5")
+    else:
+        # one grouped resample for all cities (select column BEFORE resampling, 'h' lowercase)
+        hourly = (
+            trends_df.set_index("time")
+            .groupby("city", observed=True)["pm2_5"]
+            .resample("h")
+            .mean()
+            .unstack(level=0)
+        )
+    hourly = hourly.dropna(axis=1, how="all")
+    if not hourly.empty:
+        hourly.plot(ax=ax)
+    ax.legend()
+    ax.set_title("Hourly PM2.5 Trends by City")
+    ax.set_xlabel("Time (UTC)")
+    ax.set_ylabel("PM2.5 (µg/m³)")
+    _save_figure(fig, PLOTS_DIR / "hourly_pm25_trends.png")
 
     # 4) Scatter: severity_score vs pm2_5
-    plt.figure(figsize=(8, 6))
-    plt.scatter(df["pm2_5"], df["severity_score"], alpha=0.6)
-    plt.xlabel("PM2.5 (µg/m³)")
-    plt.ylabel("Severity Score")
-    plt.title("Severity Score vs PM2.5")
-    plt.tight_layout()
-    plt.savefig(PLOTS_DIR / "severity_vs_pm25_scatter.png", dpi=150)
-    plt.close()
-
+    ax = _reset_figure(fig, (8, 6))
+    # cap the number of markers drawn; rasterize only the marker layer so axes/text stay vector
+    scatter_df = points.sample(SCATTER_MAX_POINTS, random_state=0) if len(points) > SCATTER_MAX_POINTS else points
+    ax.scatter(
+        scatter_df["pm2_5"].to_numpy(dtype=np.float32, na_value=np.nan),
+        scatter_df["severity_score"].to_numpy(dtype=np.float32, na_value=np.nan),
+        alpha=0.6,
+        rasterized=True,
+    )
+    ax.set_xlabel("PM2.5 (µg/m³)")
+    ax.set_ylabel("Severity Score")
+    ax.set_title("Severity Score vs PM2.5")
+    _save_figure(fig, PLOTS_DIR / "severity_vs_pm25_scatter.png")
+
+    plt.close(fig)
     print("CSV outputs and plots saved to:", OUTPUT_DIR)
 
 
 def main():
+    # with ETL_USE_RPC=1 and the functions installed the table is not downloaded; otherwise full fetch
+    aggregates = fetch_aggregates() if USE_RPC else None
+    if aggregates is not None:
+        if aggregates["points"].empty:
+            print("No data returned from Supabase table.")
+            return
+        save_csvs_and_plots(None, aggregates=aggregates)
+        print("Analysis complete.")
+        return
+
     df = fetch_table_as_df()
     if df.empty:
         print("No data returned from Supabase table.")
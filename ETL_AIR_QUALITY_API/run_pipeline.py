@@ -4,11 +4,14 @@ Run the full ETL pipeline end-to-end:
 
 1. extract.py          -> fetch_all_cities(...) or fallback to `python extract.py`
 2. transform.py        -> transform_files(json_paths) or fallback to `python transform.py`
-3. load.py             -> load_csv_to_supabase(...) or fallback to `python load.py`
+3. load.py             -> load_df_to_supabase(df) / load_csv_to_supabase(...) or fallback to `python load.py`
 4. etl_analysis.py     -> main() or fallback to `python etl_analysis.py`
 
 Behavior:
 - Attempts to import and call the functions directly (preferred).
+- When stages run in-process, the transformed DataFrame is handed to load directly (STAGE_DATA)
+  instead of being re-read from the staged CSV; the raw JSON and staged CSV are still written as
+  checkpoints. Analysis always reads the Supabase table (all loaded runs, not just this one).
 - If import fails (or an imported function is missing), falls back to running the script
   as a subprocess using the current Python interpreter.
 - Performs basic checks between stages (e.g., raw files existed, transformed CSV exists).
@@ -17,12 +20,15 @@ Behavior:
 """
 from __future__ import annotations
 
+import importlib
+import importlib.util
 import sys
 import subprocess
 import traceback
 from pathlib import Path
 from datetime import datetime
-from typing import List, Optional
+from types import ModuleType
+from typing import Any, Dict, List, Optional
 
 ROOT = Path(__file__).resolve().parents[0]
 RAW_DIR = ROOT / "data" / "raw"
@@ -31,6 +37,9 @@ TRANSFORMED_CSV = STAGED_DIR / "air_quality_transformed.csv"
 
 PY = sys.executable  # python interpreter to run subprocesses
 
+# DataFrames produced by in-process stages, consumed by later stages (e.g. "transformed")
+STAGE_DATA: Dict[str, Any] = {}
+
 
 def _now() -> str:
     return datetime.utcnow().isoformat(timespec="seconds") + "Z"
@@ -40,23 +49,32 @@ def _run_subprocess(script: Path, args: Optional[List[str]] = None) -> int:
     cmd = [PY, str(script)]
     if args:
         cmd += args
-    print(f"[{_now()}] > Running: {' '.join(cmd)}")
-    proc = subprocess.run(cmd, capture_output=True, text=True)
-    print(proc.stdout or "", end="")
-    if proc.stderr:
-        print(proc.stderr, file=sys.stderr)
+    print(f"[{_now()}] > Running: {' '.join(cmd)}", flush=True)
+    # child inherits our stdout/stderr: output streams live instead of being buffered here
+    proc = subprocess.run(cmd, stdout=None, stderr=None, check=False)
     return proc.returncode
 
 
+def _import_stage_module(name: str) -> Optional[ModuleType]:
+    """
+    Import a stage module by name, or return None if it can't be found on sys.path.
+    find_spec avoids paying for a failed import; repeated imports are served from sys.modules.
+    """
+    if importlib.util.find_spec(name) is None:
+        print(f"Module '{name}' not found; falling back to subprocess.")
+        return None
+    return importlib.import_module(name)
+
+
 def run_extract_via_import() -> bool:
     """
     Try to import extract.fetch_all_cities and run it.
     Returns True on success (saved files present), False otherwise.
     """
     try:
-        import importlib
-
-        mod = importlib.import_module("extract")
+        mod = _import_stage_module("extract")
+        if mod is None:
+            return False
         if hasattr(mod, "fetch_all_cities"):
             print(f"[{_now()}] Running extract.fetch_all_cities()")
             res = mod.fetch_all_cities()  # expect list of dicts
@@ -83,16 +101,16 @@ def run_transform_via_import(raw_files: Optional[List[Path]] = None) -> bool:
     Returns True if transformed CSV exists after running.
     """
     try:
-        import importlib
-
-        mod = importlib.import_module("transform")
+        mod = _import_stage_module("transform")
+        if mod is None:
+            return False
         if hasattr(mod, "transform_files"):
             # prepare list of raw files
             if raw_files is None:
                 raw_files = sorted([p for p in RAW_DIR.glob("*_raw_*") if p.suffix in (".json", ".txt")])
             raw_paths = [str(p) for p in raw_files]
             print(f"[{_now()}] Running transform.transform_files(...) on {len(raw_paths)} files")
-            mod.transform_files(raw_paths)
+            STAGE_DATA["transformed"] = mod.transform_files(raw_paths)
             return TRANSFORMED_CSV.exists()
         else:
             print("transform.transform_files not found; falling back to subprocess.")
@@ -109,9 +127,14 @@ def run_load_via_import() -> bool:
     Returns True if the load step was attempted (we can't always detect DB success here).
     """
     try:
-        import importlib
-
-        mod = importlib.import_module("load")
+        mod = _import_stage_module("load")
+        if mod is None:
+            return False
+        df = STAGE_DATA.get("transformed")
+        if df is not None and hasattr(mod, "load_df_to_supabase"):
+            print(f"[{_now()}] Running load.load_df_to_supabase(...) on in-memory transform output")
+            mod.load_df_to_supabase(df)
+            return True
         if hasattr(mod, "load_csv_to_supabase"):
             print(f"[{_now()}] Running load.load_csv_to_supabase(...)")
             # call with the path constant expected by that module or pass TRANSFORMED_CSV
@@ -136,9 +159,9 @@ def run_analysis_via_import() -> bool:
     Returns True if main() executed without raising.
     """
     try:
-        import importlib
-
-        mod = importlib.import_module("etl_analysis")
+        mod = _import_stage_module("etl_analysis")
+        if mod is None:
+            return False
         if hasattr(mod, "main"):
             print(f"[{_now()}] Running etl_analysis.main()")
             mod.main()
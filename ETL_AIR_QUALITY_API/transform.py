@@ -6,21 +6,43 @@ Fixes:
  - Automatically infer city name (prefer payload, fallback to filename)
  - Keeps original behavior: flatten hourly-style JSON when present
  - Robust to common OpenAQ/Open-Meteo shapes (best-effort)
- - Saves transformed CSV to data/staged/air_quality_transformed.csv
+ - Saves transformed CSV to data/staged/air_quality_transformed.csv, plus a typed Parquet copy
+   (air_quality_transformed.parquet, snappy) when pyarrow is installed
+ - Flattens files in-process by default; TRANSFORM_WORKERS>1 (or 0 = one per CPU) flattens them in
+   worker processes. Only worth it for many/large raw files: spawning workers re-imports pandas,
+   which costs far more than flattening a handful of small payloads
 """
 from __future__ import annotations
 
 import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from typing import List, Optional
 
+import numpy as np
 import pandas as pd
 
+# Optional: faster JSON parsing for large hourly payloads
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Optional: Parquet copy of the staged output (dtypes preserved, much faster to re-read)
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
 # Directories
 RAW_DIR = Path("data/raw")
 STAGED_DIR = Path("data/staged")
 STAGED_DIR.mkdir(parents=True, exist_ok=True)
 OUTPUT_FILE = STAGED_DIR / "air_quality_transformed.csv"
+OUTPUT_PARQUET = OUTPUT_FILE.with_suffix(".parquet")
+TRANSFORM_WORKERS = int(os.getenv("TRANSFORM_WORKERS", "1"))  # processes for flattening files (1 = no pool, 0 = one per CPU)
 
 # Mapping OpenAQ/Open-Meteo parameter names to our columns
 POLLUTANT_MAPPING = {
@@ -36,58 +58,45 @@ POLLUTANT_MAPPING = {
     "uv": "uv_index",
 }
 
+# Same mapping keyed by normalized names (lowercase, "." and "-" -> "_")
+_NORM_RE = re.compile(r"[.\-]")
+POLLUTANT_MAPPING_LOWER = {_NORM_RE.sub("_", k.lower()): v for k, v in POLLUTANT_MAPPING.items()}
+
 POLLUTANT_COLS = ["pm10", "pm2_5", "carbon_monoxide", "nitrogen_dioxide", "sulphur_dioxide", "ozone", "uv_index"]
+# Column order of every flattened per-file frame (same layout, so concat doesn't have to align)
+FLAT_COLS = ["city", "time"] + POLLUTANT_COLS
+
+# Derived feature thresholds (right-inclusive bins: pm <= 50 -> Good, severity <= 200 -> Low Risk, ...)
+AQI_BINS = [-np.inf, 50, 100, 200, 300, np.inf]
+AQI_LABELS = ["Good", "Moderate", "Unhealthy", "Very Unhealthy", "Hazardous"]
+SEVERITY_WEIGHTS = {
+    "pm2_5": 5,
+    "pm10": 3,
+    "nitrogen_dioxide": 4,
+    "sulphur_dioxide": 4,
+    "carbon_monoxide": 2,
+    "ozone": 3,
+}
+RISK_BINS = [-np.inf, 200, 400, np.inf]
+RISK_LABELS = ["Low Risk", "Moderate Risk", "High Risk"]
 
 
-def calculate_aqi(pm2_5):
-    """AQI category based on PM2.5"""
-    if pm2_5 is None:
-        return None
-    try:
-        pm = float(pm2_5)
-    except Exception:
-        return None
-    if pm <= 50:
-        return "Good"
-    elif pm <= 100:
-        return "Moderate"
-    elif pm <= 200:
-        return "Unhealthy"
-    elif pm <= 300:
-        return "Very Unhealthy"
-    else:
-        return "Hazardous"
+def calculate_aqi(pm2_5: pd.Series) -> pd.Series:
+    """AQI category based on PM2.5 (vectorized; NaN stays NaN)"""
+    return pd.cut(pm2_5, bins=AQI_BINS, labels=AQI_LABELS)
 
 
-def calculate_severity(row):
-    """Pollution Severity Score using weighted pollutants"""
-    def s(x):
-        try:
-            return float(x) if x is not None else 0.0
-        except Exception:
-            return 0.0
-    return (
-        s(row.get("pm2_5", 0)) * 5 +
-        s(row.get("pm10", 0)) * 3 +
-        s(row.get("nitrogen_dioxide", 0)) * 4 +
-        s(row.get("sulphur_dioxide", 0)) * 4 +
-        s(row.get("carbon_monoxide", 0)) * 2 +
-        s(row.get("ozone", 0)) * 3
-    )
+def calculate_severity(df: pd.DataFrame) -> pd.Series:
+    """Pollution Severity Score using weighted pollutants (missing values count as 0)"""
+    sev = np.zeros(len(df), dtype=np.float64)
+    for col, weight in SEVERITY_WEIGHTS.items():
+        sev += weight * df[col].to_numpy(dtype=np.float64, na_value=0.0)
+    return pd.Series(sev, index=df.index)
 
 
-def calculate_risk(severity):
-    """Risk classification based on severity score"""
-    try:
-        sev = float(severity)
-    except Exception:
-        return None
-    if sev > 400:
-        return "High Risk"
-    elif sev > 200:
-        return "Moderate Risk"
-    else:
-        return "Low Risk"
+def calculate_risk(severity: pd.Series) -> pd.Series:
+    """Risk classification based on severity score (vectorized)"""
+    return pd.cut(severity, bins=RISK_BINS, labels=RISK_LABELS)
 
 
 def _infer_city_from_payload(payload: dict) -> Optional[str]:
@@ -137,54 +146,103 @@ def _infer_city_from_filename(path: Path) -> Optional[str]:
     return None
 
 
+def _load_json(path: Path):
+    """Parse a raw JSON file, using orjson's much faster C parser when it is installed."""
+    if orjson is not None:
+        return orjson.loads(path.read_bytes())
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _walk_for_measurements(obj) -> list:
+    """
+    Collect the items of every 'measurements' / 'values' list anywhere in obj.
+    Iterative (explicit stack) so deep payloads don't pay a generator frame per node;
+    item order doesn't matter since they are averaged per city-hour afterwards.
+    """
+    found = []
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if isinstance(o, dict):
+            for k, v in o.items():
+                if k.lower() in ("measurements", "values") and isinstance(v, list):
+                    found.extend(v)
+                else:
+                    stack.append(v)
+        elif isinstance(o, list):
+            stack.extend(o)
+    return found
+
+
+def _first_present(df: pd.DataFrame, cols: List[str], default=None) -> pd.Series:
+    """Column-wise `a or b or c`: per row, the first of cols that is present and non-empty."""
+    out = pd.Series(default, index=df.index, dtype=object)
+    for col in reversed(cols):
+        if col in df.columns:
+            vals = df[col]
+            out = vals.where(vals.notna() & (vals != ""), out)
+    return out
+
+
+def _normalize_v2_results(results: list, city: str) -> pd.DataFrame:
+    """
+    OpenAQ v2 results (locations with measurements) -> city/time/parameter/value rows.
+    json_normalize expands all measurements in one call; nested date.utc becomes its own column.
+    """
+    results = [loc for loc in results if isinstance(loc, dict) and loc.get("measurements")]
+    if not results:
+        return pd.DataFrame(columns=["city", "time", "parameter", "value"])
+    meas = pd.json_normalize(
+        results, record_path="measurements", meta=["city", "location"], meta_prefix="loc_", errors="ignore"
+    )
+    return pd.DataFrame({
+        "city": _first_present(meas, ["loc_city", "loc_location"], city),
+        # time may be under m['lastUpdated'] or m['date']['utc']
+        "time": _first_present(meas, ["lastUpdated", "date.utc", "date"]),
+        "parameter": _first_present(meas, ["parameter", "param", "name"]),
+        "value": meas["value"] if "value" in meas.columns else None,
+    })
+
+
 def flatten_city_json(file_path: str, city_name: Optional[str] = None) -> pd.DataFrame:
     """
     Flatten a single raw JSON file into a DataFrame with one row per timestamp.
     Tries to support both Open-Meteo (hourly arrays) and OpenAQ (results/locations).
     """
     p = Path(file_path)
-    with open(p, "r", encoding="utf-8") as f:
-        payload = json.load(f)
+    payload = _load_json(p)
 
     # infer city if not provided
     city = city_name or _infer_city_from_payload(payload) or _infer_city_from_filename(p) or "Unknown"
 
-    records = []
-
     # Case 1: Open-Meteo-like hourly arrays (payload['hourly'] with arrays)
     hourly = payload.get("hourly")
     if isinstance(hourly, dict) and hourly.get("time"):
         times = hourly.get("time", [])
+        n = len(times)
+        # build the frame column-wise from the hourly arrays (one parse of all timestamps)
+        cols = {"city": city, "time": pd.to_datetime(times)}
         # try to find pollutant arrays with mapping keys; some payloads might already use our names
-        for i, t in enumerate(times):
-            rec = {"city": city, "time": pd.to_datetime(t)}
-            for src_key, dest_col in POLLUTANT_MAPPING.items():
-                # prefer exact key in hourly, else try dest_col directly
-                values = None
-                if src_key in hourly:
-                    values = hourly.get(src_key)
-                elif dest_col in hourly:
-                    values = hourly.get(dest_col)
-                if isinstance(values, list) and i < len(values):
-                    rec[dest_col] = values[i]
-                else:
-                    rec[dest_col] = None
-            records.append(rec)
-        return pd.DataFrame(records)
+        for src_key, dest_col in POLLUTANT_MAPPING.items():
+            if dest_col in cols:
+                continue
+            # prefer exact key in hourly, else try dest_col directly
+            values = hourly.get(src_key) if src_key in hourly else hourly.get(dest_col)
+            if isinstance(values, list):
+                # pad/truncate arrays whose length doesn't match the time axis
+                cols[dest_col] = values if len(values) == n else values[:n] + [None] * (n - len(values))
+        for col in POLLUTANT_COLS:
+            cols.setdefault(col, np.nan)
+        return pd.DataFrame(cols, columns=FLAT_COLS)
 
     # Case 2: OpenAQ-like payload: results -> locations with measurements
     # We'll extract per-measurement and then aggregate to hourly later.
     measurements = []
-    # v2 style
+    dfm = None
+    # v2 style (flattened by json_normalize straight into a frame)
     if isinstance(payload, dict) and "results" in payload and isinstance(payload["results"], list):
-        for loc in payload["results"]:
-            loc_city = loc.get("city") or loc.get("location") or city
-            for m in loc.get("measurements", []):
-                parameter = m.get("parameter") or m.get("param") or m.get("name")
-                value = m.get("value")
-                # time may be under m['lastUpdated'] or m['date']['utc']
-                t = m.get("lastUpdated") or (m.get("date") and m["date"].get("utc")) or m.get("date")
-                measurements.append({"city": loc_city, "time": t, "parameter": parameter, "value": value})
+        dfm = _normalize_v2_results(payload["results"], city)
     # v3 style: locations -> parameters (lastValue/lastUpdated) or measurements
     elif isinstance(payload, dict) and "locations" in payload and isinstance(payload["locations"], list):
         for loc in payload["locations"]:
@@ -203,17 +261,6 @@ def flatten_city_json(file_path: str, city_name: Optional[str] = None) -> pd.Dat
     else:
         # Unknown structure: try to find any measurements under keys
         # attempt to locate 'measurements' or 'values' anywhere in payload
-        def _walk_for_measurements(obj):
-            if isinstance(obj, dict):
-                for k, v in obj.items():
-                    if k.lower() in ("measurements", "values") and isinstance(v, list):
-                        for m in v:
-                            yield m
-                    else:
-                        yield from _walk_for_measurements(v)
-            elif isinstance(obj, list):
-                for item in obj:
-                    yield from _walk_for_measurements(item)
         for m in _walk_for_measurements(payload):
             parameter = m.get("parameter") or m.get("name") or m.get("param")
             value = m.get("value")
@@ -221,66 +268,62 @@ def flatten_city_json(file_path: str, city_name: Optional[str] = None) -> pd.Dat
             measurements.append({"city": city, "time": t, "parameter": parameter, "value": value})
 
     # If we collected raw measurements, pivot them into one row per city-hour
-    if measurements:
+    if dfm is None and measurements:
         dfm = pd.DataFrame.from_records(measurements)
+    if dfm is not None and not dfm.empty:
         # parse times robustly
         dfm["time"] = pd.to_datetime(dfm["time"], errors="coerce", utc=True)
         dfm = dfm.dropna(subset=["time"])
         if dfm.empty:
-            return pd.DataFrame(columns=["city", "time"] + POLLUTANT_COLS)
+            return pd.DataFrame(columns=FLAT_COLS)
         # floor to hour
         dfm["time_hour"] = dfm["time"].dt.floor("H")
-        # normalize parameter names via mapping (lower/strip)
-        dfm["parameter_norm"] = dfm["parameter"].astype(str).str.strip().str.lower().replace({
-            k.lower(): v for k, v in POLLUTANT_MAPPING.items()
-        })
-        # map common variants (e.g., pm2.5 -> pm25)
-        dfm["parameter_norm"] = dfm["parameter_norm"].str.replace(".", "_").str.replace("-", "_")
-        dfm["parameter_norm"] = dfm["parameter_norm"].map(lambda x: POLLUTANT_MAPPING.get(x, x) if isinstance(x, str) else x)
+        # normalize parameter names (lower/strip, pm2.5 -> pm2_5) then map to our columns in one lookup
+        norm = dfm["parameter"].astype(str).str.strip().str.lower().str.replace(_NORM_RE, "_", regex=True)
+        dfm["parameter_norm"] = norm.map(POLLUTANT_MAPPING_LOWER).fillna(norm)
         # convert value to numeric
         dfm["value_num"] = pd.to_numeric(dfm["value"], errors="coerce")
 
-        # pivot mean of values per city-hour-parameter
-        pv = (
-            dfm.groupby(["city", "time_hour", "parameter_norm"])["value_num"]
-            .mean()
-            .reset_index()
-            .pivot_table(index=["city", "time_hour"], columns="parameter_norm", values="value_num", aggfunc="first")
-            .reset_index()
-        )
+        # pivot mean of values per city-hour-parameter (single hash aggregation)
+        pv = dfm.pivot_table(
+            index=["city", "time_hour"], columns="parameter_norm", values="value_num", aggfunc="mean"
+        ).reset_index()
 
         # ensure pollutant columns present
         for col in POLLUTANT_COLS:
             if col not in pv.columns:
                 pv[col] = pd.NA
 
+        # time_hour is already datetime64[ns, UTC] (parsed with utc=True, then floored)
         pv = pv.rename(columns={"time_hour": "time"})
-        # ensure time is datetime
-        pv["time"] = pd.to_datetime(pv["time"], utc=True)
         # reorder to desired columns
-        cols = ["city", "time"] + POLLUTANT_COLS
-        return pv[cols]
+        return pv[FLAT_COLS]
 
     # If nothing matched, return empty df with expected columns
-    return pd.DataFrame(columns=["city", "time"] + POLLUTANT_COLS)
+    return pd.DataFrame(columns=FLAT_COLS)
 
 
 def transform_files(file_paths: List[str]):
     """Transform multiple JSON files and save to CSV"""
-    all_frames = []
-    for fp in file_paths:
-        df = flatten_city_json(fp)
-        if not df.empty:
-            all_frames.append(df)
+    workers = min(len(file_paths), TRANSFORM_WORKERS or os.cpu_count() or 1)
+    if workers > 1:
+        # opt-in (TRANSFORM_WORKERS): files are independent and CPU-bound, but worker start-up dominates
+        # unless the raw files are many or large
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            frames = list(executor.map(flatten_city_json, file_paths))
+    else:
+        frames = [flatten_city_json(fp) for fp in file_paths]
+    all_frames = [df for df in frames if not df.empty]
 
     if not all_frames:
         print("No data to transform.")
         # save empty CSV with correct headers
-        empty = pd.DataFrame(columns=["city", "time"] + POLLUTANT_COLS + ["aqi_category", "severity", "risk", "hour"])
+        empty = pd.DataFrame(columns=FLAT_COLS + ["aqi_category", "severity", "risk", "hour"])
         empty.to_csv(OUTPUT_FILE, index=False)
         return empty
 
-    df_all = pd.concat(all_frames, ignore_index=True)
+    # frames already share FLAT_COLS order: no sorting/alignment of columns
+    df_all = pd.concat(all_frames, ignore_index=True, sort=False)
 
     # Ensure all pollutant columns exist
     for col in POLLUTANT_COLS:
@@ -294,14 +337,22 @@ def transform_files(file_paths: List[str]):
     # Remove rows where all pollutants are missing
     df_all = df_all.dropna(subset=POLLUTANT_COLS, how="all").reset_index(drop=True)
 
-    # Derived features
-    df_all["AQI"] = df_all["pm2_5"].apply(lambda x: calculate_aqi(x) if pd.notnull(x) else None)
-    df_all["severity"] = df_all.apply(calculate_severity, axis=1)
-    df_all["risk"] = df_all["severity"].apply(calculate_risk)
+    # Derived features (column-wise, no per-row Python calls)
+    df_all["AQI"] = calculate_aqi(df_all["pm2_5"])
+    df_all["severity"] = calculate_severity(df_all)
+    df_all["risk"] = calculate_risk(df_all["severity"])
     df_all["hour"] = df_all["time"].dt.hour
+    # low-cardinality labels as categories (AQI / risk already are, from pd.cut)
+    df_all["city"] = df_all["city"].astype("category")
 
-    # Save CSV
+    # Save CSV (+ Parquet for load.py, which prefers it when it is at least as new as the CSV)
     df_all.to_csv(OUTPUT_FILE, index=False)
+    if pyarrow is not None:
+        try:
+            df_all.to_parquet(OUTPUT_PARQUET, compression="snappy", index=False)
+        except (ValueError, TypeError) as e:
+            # e.g. a time column mixing tz-aware and naive timestamps; the CSV is still there
+            print(f"⚠️ Skipped Parquet copy: {e}")
     print(f"✅ Transformed data saved to {OUTPUT_FILE} (rows={len(df_all)})")
     return df_all
 
@@ -17,18 +17,23 @@ df = pd.DataFrame(data)
 # Normalize column names
 df.columns = [c.lower() for c in df.columns]
 
+# Low-cardinality text columns as categories (faster groupby / value_counts)
+for c in ["churn", "contract", "internetservice", "tenure_group"]:
+    df[c] = df[c].astype("category")
+
 # =====================
 # METRICS
 # =====================
 
 summary = []
 
-# 1. Churn percentage
-churn_pct = (df["churn"].str.lower() == "yes").mean() * 100
+# 1. Churn percentage (lowercase the few category labels, not every row)
+churn_yes = [c for c in df["churn"].cat.categories if str(c).lower() == "yes"]
+churn_pct = df["churn"].isin(churn_yes).mean() * 100
 summary.append(["churn_percentage", churn_pct])
 
 # 2. Average monthly charges per contract
-avg_monthly = df.groupby("contract")["monthlycharges"].mean()
+avg_monthly = df.groupby("contract", observed=True)["monthlycharges"].mean()
 for k, v in avg_monthly.items():
     summary.append([f"avg_monthlycharges_{k}", v])
 
@@ -5,10 +5,13 @@
 
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import pandas as pd
 from supabase import create_client, Client
 from dotenv import load_dotenv
 
+from transform import STAGED_DTYPES, read_staged
+
 
 # ----------------------------------------
 # Supabase client
@@ -55,11 +58,11 @@ def print_create_table_sql():
 
 def check_table_exists(table_name: str = "telco_customer_churn_features"):
     """
-    Tries a simple SELECT to see if the table exists.
+    Tries a HEAD request (no rows transferred) to see if the table exists.
     """
     try:
         supabase = get_supabase_client()
-        supabase.table(table_name).select("*").limit(1).execute()
+        supabase.table(table_name).select("id", head=True).execute()
         print(f"✅ Table '{table_name}' exists in Supabase.")
     except Exception as e:
         print(f"⚠️  Could not verify table '{table_name}': {e}")
@@ -69,10 +72,45 @@ def check_table_exists(table_name: str = "telco_customer_churn_features"):
 # ----------------------------------------
 # Step 2: Load CSV data into Supabase table
 # ----------------------------------------
+def _insert_with_retry(
+    supabase: Client,
+    table_name: str,
+    start: int,
+    records: list,
+    total_rows: int,
+    batch_size: int,
+    max_retries: int = 3,
+) -> bool:
+    """
+    Inserts one batch, retrying SSL EOF errors. Returns True on success.
+    """
+    batch_no = start // batch_size + 1
+    for attempt in range(max_retries):
+        try:
+            supabase.table(table_name).insert(records).execute()
+            end = min(start + batch_size, total_rows)
+            print(f"✅ Inserted rows {start+1}-{end} of {total_rows}")
+            return True
+        except Exception as e:
+            msg = str(e)
+            if "EOF occurred in violation of protocol" in msg and attempt < max_retries - 1:
+                print(
+                    f"⚠️  SSL error on batch {batch_no}, "
+                    f"retrying (attempt {attempt+2}/{max_retries})..."
+                )
+                time.sleep(2)
+                continue
+            else:
+                print(f"⚠️  Error in batch {batch_no}: {e}")
+                return False  # don't retry further for other errors
+    return False
+
+
 def load_to_supabase(
     staged_path: str,
     table_name: str = "telco_customer_churn_features",
     batch_size: int = 200,
+    max_workers: int = 8,
 ):
 
     # Convert to absolute path
@@ -91,8 +129,8 @@ def load_to_supabase(
     try:
         supabase = get_supabase_client()
 
-        # Read CSV
-        df = pd.read_csv(staged_path)
+        # Read staged data, only the table's columns (Parquet copy if fresh, else CSV; typed on read)
+        df = read_staged(staged_path, columns=list(STAGED_DTYPES))
 
         # ----------------------------------------
         # Normalize column names to lowercase
@@ -122,56 +160,32 @@ def load_to_supabase(
             print(f"❌ Error: Missing columns in CSV: {missing}")
             return
 
-        df = df[needed_cols].copy()
-
-        # ----------------------------------------
-        # Ensure numeric columns are numeric
-        # ----------------------------------------
-        numeric_cols = [
-            "tenure",
-            "monthlycharges",
-            "totalcharges",
-            "has_internet_service",
-            "is_multi_line_user",
-            "contract_type_code",
-        ]
-
-        for col in numeric_cols:
-            df[col] = pd.to_numeric(df[col], errors="coerce")
+        df = df[needed_cols]
 
         total_rows = len(df)
         print(f"📊 Loading {total_rows} rows into '{table_name}'...")
 
         # ----------------------------------------
         # Batch insert with retry logic
+        # (batches are sent concurrently: each one is mostly waiting on the network)
         # ----------------------------------------
-        for i in range(0, total_rows, batch_size):
-            batch = df.iloc[i : i + batch_size].copy()
-
-            # NaN -> None so Supabase stores NULL
-            batch = batch.where(pd.notnull(batch), None)
-            records = batch.to_dict("records")
-
-            max_retries = 3
-            for attempt in range(max_retries):
-                try:
-                    supabase.table(table_name).insert(records).execute()
-                    end = min(i + batch_size, total_rows)
-                    print(f"✅ Inserted rows {i+1}-{end} of {total_rows}")
-                    break  # success, leave retry loop
-                except Exception as e:
-                    msg = str(e)
-                    if "EOF occurred in violation of protocol" in msg and attempt < max_retries - 1:
-                        print(
-                            f"⚠️  SSL error on batch {i//batch_size + 1}, "
-                            f"retrying (attempt {attempt+2}/{max_retries})..."
-                        )
-                        time.sleep(2)
-                        continue
-                    else:
-                        print(f"⚠️  Error in batch {i//batch_size + 1}: {e}")
-                        break  # don't retry further for other errors
-
+        # One pass over the data: object array with NaN -> None so Supabase stores NULL
+        cols = df.columns.tolist()
+        values = df.to_numpy(dtype=object)
+        values[pd.isna(values)] = None
+        records = [dict(zip(cols, row)) for row in values]
+
+        batches = [(i, records[i : i + batch_size]) for i in range(0, total_rows, batch_size)]
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(_insert_with_retry, supabase, table_name, start, batch, total_rows, batch_size)
+                for start, batch in batches
+            ]
+            failed = sum(1 for f in as_completed(futures) if not f.result())
+
+        if failed:
+            print(f"⚠️  {failed} of {len(batches)} batches failed")
         print(f"🎯 Finished loading data into '{table_name}'.")
 
     except Exception as e:
@@ -7,6 +7,49 @@ import os
 import pandas as pd
 import numpy as np
 
+# Optional: Parquet copy of the staged data (needs pyarrow)
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+# Column dtypes of the staged CSV, for readers (load.py / validate.py) so they skip type inference.
+# Charges stay float64: they land in DOUBLE PRECISION columns and float32 would round the cents.
+STAGED_DTYPES = {
+    "tenure": "Int32",
+    "MonthlyCharges": "float64",
+    "TotalCharges": "float64",
+    "has_internet_service": "Int8",
+    "is_multi_line_user": "Int8",
+    "contract_type_code": "Int8",
+    "Churn": "category",
+    "Contract": "category",
+    "InternetService": "category",
+    "PaymentMethod": "category",
+    "tenure_group": "category",
+    "monthly_charge_segment": "category",
+}
+
+
+def read_staged(staged_path, columns=None):
+    """
+    Read the staged data: the Parquet copy next to the CSV when it exists and isn't older
+    than the CSV (dtypes preserved, no parsing), otherwise the CSV with the pyarrow engine
+    and STAGED_DTYPES, otherwise the default CSV parser.
+    """
+    parquet_path = os.path.splitext(staged_path)[0] + ".parquet"
+    if os.path.exists(parquet_path) and os.path.getmtime(parquet_path) >= os.path.getmtime(staged_path):
+        try:
+            return pd.read_parquet(parquet_path, columns=columns)
+        except ImportError:
+            pass
+    kwargs = {"usecols": columns, "dtype": STAGED_DTYPES}
+    try:
+        return pd.read_csv(staged_path, engine="pyarrow", **kwargs)
+    except ImportError:
+        return pd.read_csv(staged_path, **kwargs)
+
  
 # Purpose: Clean and transform Titanic dataset
 def transform_data(raw_path):
@@ -24,36 +67,45 @@ def transform_data(raw_path):
     df[category_cols]=df[category_cols].fillna("unknown")
  
     # --- 2️⃣ Feature engineering ---
-    df['tenure_group']=np.where(
-    df['tenure']<=12,"New",
-    np.where(df['tenure']<=36,"Regular",
-             np.where(df['tenure']<=60,"Loyal","Champion")
-            )
-        )
-    df['monthly_charge_segment']=np.where(
-        df['MonthlyCharges']<30,"Low",
-        np.where(df['MonthlyCharges']<=70,"Medium","High"
-        )
-             
+    # tenure: <=12 New, <=36 Regular, <=60 Loyal, else Champion
+    df['tenure_group']=pd.cut(
+        df['tenure'],
+        bins=[-np.inf,12,36,60,np.inf],
+        labels=["New","Regular","Loyal","Champion"]
+    )
+    # charges: <30 Low, 30-70 (inclusive) Medium, >70 High
+    # left-closed bins; nextafter keeps exactly 70 in "Medium"
+    df['monthly_charge_segment']=pd.cut(
+        df['MonthlyCharges'],
+        bins=[-np.inf,30,np.nextafter(70,np.inf),np.inf],
+        labels=["Low","Medium","High"],
+        right=False
     )
     df["has_internet_service"] = df["InternetService"].isin(
         ["DSL", "Fiber optic"]
-    ).astype(int)
-    df["is_multi_line_user"] = (df["MultipleLines"] == "Yes").astype(int)
+    ).astype("Int8")
+    df["is_multi_line_user"] = (df["MultipleLines"] == "Yes").astype("Int8")
     contract_map = {
         "Month-to-month": 0,
         "One year": 1,
         "Two year": 2
     }
 
-    df["contract_type_code"] = df["Contract"].map(contract_map)
+    # nullable Int8: stays integer even if a contract is unmapped (no float64 NaN column)
+    df["contract_type_code"] = df["Contract"].map(contract_map).astype("Int8")
  
     # --- 3️⃣ Drop unnecessary columns ---
     df.drop(columns=["customerID", "gender"], inplace=True)
  
-    # --- 4️⃣ Save transformed data ---
+    # --- 4️⃣ Low-cardinality text columns as categories (int codes instead of repeated strings) ---
+    for c in ["tenure_group","monthly_charge_segment","Churn","Contract","InternetService","PaymentMethod"]:
+        df[c]=df[c].astype("category")
+ 
+    # --- 5️⃣ Save transformed data ---
     staged_path = os.path.join(staged_dir, "Telco-Customer_transformed.csv")
     df.to_csv(staged_path, index=False)
+    if pyarrow is not None:
+        df.to_parquet(os.path.splitext(staged_path)[0] + ".parquet", compression="snappy", index=False)
     print(f"✅ Data transformed and saved at: {staged_path}")
     return staged_path
  
@@ -1,7 +1,9 @@
 import pandas as pd
 
-# 1️⃣ Load your transformed CSV
-df = pd.read_csv(r"..\data\staged\Telco-Customer_transformed.csv")
+from transform import read_staged
+
+# 1️⃣ Load your transformed data (Parquet copy when fresh, else CSV; typed on read)
+df = read_staged(r"..\data\staged\Telco-Customer_transformed.csv")
 
 # 2️⃣ Normalize column names to lowercase
 df.columns = [c.strip().lower() for c in df.columns]
@@ -23,7 +25,9 @@ def validate_telco_data(df: pd.DataFrame, original_row_count: int):
             print(f"❌ {col}: {missing_numeric[col]} missing values")
 
     # Unique row count vs original
-    unique_rows = df.drop_duplicates().shape[0]
+    # count duplicates with a boolean mask instead of materializing a deduplicated copy
+    dup_count = int(df.duplicated().sum())
+    unique_rows = len(df) - dup_count
     print("\n✅ Uniqueness Check:")
     print(f"✔ Unique rows: {unique_rows}")
     print(f"✔ Original rows: {original_row_count}")